@@ -15,8 +15,9 @@
 """
 Collection of Losses.
 """
+import math
 from enum import Enum
-from typing import Dict, Literal, Optional, Tuple, cast
+from typing import Callable, Dict, List, Literal, Optional, Tuple, cast
 
 import torch
 from jaxtyping import Bool, Float
@@ -227,7 +228,7 @@ def pred_normal_loss(
 def basic_depth_loss(
     termination_depth: Float[Tensor, "*batch 1"],
     predicted_depth: Float[Tensor, "*batch 1"],
-)-> Float[Tensor, "*batch 1"]:
+) -> Float[Tensor, ""]:
     # depths are only considered valid if they are greater than 0. 0 depth info means no depth info
     depth_mask = termination_depth > 0
     
@@ -244,8 +245,8 @@ def ds_nerf_depth_loss(
     termination_depth: Float[Tensor, "*batch 1"],
     steps: Float[Tensor, "*batch num_samples 1"],
     lengths: Float[Tensor, "*batch num_samples 1"],
-    sigma: Float[Tensor, "0"],
-) -> Float[Tensor, "*batch 1"]:
+    sigma: Float[Tensor, "1"],
+) -> Float[Tensor, ""]:
     """Depth loss from Depth-supervised NeRF (Deng et al., 2022).
     KL divergence based loss.
     Args:
@@ -259,7 +260,7 @@ def ds_nerf_depth_loss(
     """
     depth_mask = termination_depth > 0
 
-    loss = -torch.log(weights + EPS) * torch.exp(-((steps - termination_depth[:, None]) ** 2) / (2 * sigma)) * lengths
+    loss = -torch.log(weights + EPS) * torch.exp((steps - termination_depth[:, None]) ** 2 * (-0.5 / sigma)) * lengths
     loss = loss.sum(-2) * depth_mask
     return torch.mean(loss)
 
@@ -269,8 +270,8 @@ def urban_radiance_field_depth_loss(
     termination_depth: Float[Tensor, "*batch 1"],
     predicted_depth: Float[Tensor, "*batch 1"],
     steps: Float[Tensor, "*batch num_samples 1"],
-    sigma: Float[Tensor, "0"],
-) -> Float[Tensor, "*batch 1"]:
+    sigma: Float[Tensor, "1"],
+) -> Float[Tensor, ""]:
     """Lidar losses from Urban Radiance Fields (Rematas et al., 2022).
 
     Args:
@@ -288,14 +289,16 @@ def urban_radiance_field_depth_loss(
     expected_depth_loss = (termination_depth - predicted_depth) ** 2
 
     # Line of sight losses
-    target_distribution = torch.distributions.normal.Normal(0.0, sigma / URF_SIGMA_SCALE_FACTOR)
+    # the target distribution is a normal pdf with std sigma / URF_SIGMA_SCALE_FACTOR, evaluated in closed form
+    # to avoid building a torch.distributions object (and validating its arguments) on every step
+    target_std = sigma / URF_SIGMA_SCALE_FACTOR
     termination_depth = termination_depth[:, None]
-    line_of_sight_loss_near_mask = torch.logical_and(
-        steps <= termination_depth + sigma, steps >= termination_depth - sigma
-    )
-    line_of_sight_loss_near = (weights - torch.exp(target_distribution.log_prob(steps - termination_depth))) ** 2
+    distances = steps - termination_depth
+    line_of_sight_loss_near_mask = torch.abs(distances) <= sigma
+    target_pdf = torch.exp(-0.5 * (distances / target_std) ** 2) / (target_std * math.sqrt(2 * math.pi))
+    line_of_sight_loss_near = (weights - target_pdf) ** 2
     line_of_sight_loss_near = (line_of_sight_loss_near_mask * line_of_sight_loss_near).sum(-2)
-    line_of_sight_loss_empty_mask = steps < termination_depth - sigma
+    line_of_sight_loss_empty_mask = distances < -sigma
     line_of_sight_loss_empty = (line_of_sight_loss_empty_mask * weights**2).sum(-2)
     line_of_sight_loss = line_of_sight_loss_near + line_of_sight_loss_empty
 
@@ -309,8 +312,8 @@ def depth_uncertainty_weighted_loss(
     termination_uncertainty: Float[Tensor, "*batch 1"],
     predicted_uncertainty: Float[Tensor, "*batch 1"],
     steps: Float[Tensor, "*batch num_samples 1"],
-    uncertainty_weight: Float[Tensor, "0"] = 1.0
-) -> Float[Tensor, "*batch 1"]:
+    uncertainty_weight: float = 1.0
+) -> Float[Tensor, ""]:
     """
     Depth loss from Visual Tactile Neural Fields
     Depth loss weighted by corresponding uncertainty
@@ -349,7 +352,7 @@ def dense_depth_priors_loss(
     predicted_depth: Float[Tensor, "*batch 1"],
     termination_uncertainty: Float[Tensor, "*batch 1"],
     predicted_uncertainty: Float[Tensor, "*batch 1"],
-) -> Float[Tensor, "*batch 1"]:
+) -> Float[Tensor, ""]:
     """
     Depth loss from Dense Depth Priors for Neural Radiance Fields from Sparse Input Views (Roessle et. al. 2022)
     
@@ -378,15 +381,15 @@ def depth_loss(
     ray_samples: RaySamples,
     termination_depth: Float[Tensor, "*batch 1"],
     predicted_depth: Float[Tensor, "*batch 1"],
-    sigma: Float[Tensor, "0"],
+    sigma: Float[Tensor, "1"],
     directions_norm: Float[Tensor, "*batch 1"],
     is_euclidean: bool,
     depth_loss_type: DepthLossType,
-    termination_uncertainty: Float[Tensor, "*batch 1"] = None,
-    predicted_uncertainty: Float[Tensor, "*batch 1"] = None,
-    uncertainty_weight: Float[Tensor, "0"] = 1.0
+    termination_uncertainty: Optional[Float[Tensor, "*batch 1"]] = None,
+    predicted_uncertainty: Optional[Float[Tensor, "*batch 1"]] = None,
+    uncertainty_weight: float = 1.0
     
-) -> Float[Tensor, "0"]:
+) -> Float[Tensor, ""]:
     """Implementation of depth losses.
 
     Args:
@@ -427,6 +430,166 @@ def depth_loss(
     raise NotImplementedError("Provided depth loss type not implemented.")
 
 
+def depth_loss_batched(
+    weights: Float[Tensor, "num_levels *batch num_samples 1"],
+    starts: Float[Tensor, "num_levels *batch num_samples 1"],
+    ends: Float[Tensor, "num_levels *batch num_samples 1"],
+    termination_depth: Float[Tensor, "*batch 1"],
+    predicted_depth: Float[Tensor, "*batch 1"],
+    sigma: Float[Tensor, "1"],
+    directions_norm: Optional[Float[Tensor, "*batch 1"]],
+    is_euclidean: bool,
+    depth_loss_type: DepthLossType,
+    termination_uncertainty: Optional[Float[Tensor, "*batch 1"]] = None,
+    predicted_uncertainty: Optional[Float[Tensor, "*batch 1"]] = None,
+    uncertainty_weight: float = 1.0,
+) -> Float[Tensor, ""]:
+    """Depth loss averaged over a stack of sampling levels, computed with a single call.
+
+    Equivalent to averaging :func:`depth_loss` over the levels, but the levels are folded into the
+    ray dimension so every point-wise op runs once instead of once per level.
+
+    Args:
+        weights: Weights predicted for each sample, stacked over sampling levels.
+        starts: Frustum starts of the samples, stacked over sampling levels.
+        ends: Frustum ends of the samples, stacked over sampling levels.
+        termination_depth: Ground truth depth of rays.
+        predicted_depth: Depth prediction from the network.
+        sigma: Uncertainty around depth value.
+        directions_norm: Norms of ray direction vectors in the camera frame. Only used if is_euclidean is False.
+        is_euclidean: Whether ground truth depths corresponds to normalized direction vectors.
+        depth_loss_type: Type of depth loss to apply.
+        termination_uncertainty: Ground truth depth uncertainty of rays.
+        predicted_uncertainty: Depth uncertainty prediction from the network.
+        uncertainty_weight: Weight of the uncertainty term.
+
+    Returns:
+        Depth loss scalar.
+    """
+    if not is_euclidean:
+        assert directions_norm is not None, "directions_norm is required for z-distance depths"
+        termination_depth = termination_depth * directions_norm
+
+    if depth_loss_type in (DepthLossType.DS_NERF, DepthLossType.URF):
+        num_levels = weights.shape[0]
+        # fold the levels into the ray dimension; the mean over all rays equals the mean over levels
+        weights = weights.reshape(-1, *weights.shape[-2:])
+        starts = starts.reshape(-1, *starts.shape[-2:])
+        ends = ends.reshape(-1, *ends.shape[-2:])
+        termination_depth = termination_depth.expand(num_levels, *termination_depth.shape).reshape(-1, 1)
+        steps = (starts + ends) / 2
+
+        if depth_loss_type == DepthLossType.DS_NERF:
+            return ds_nerf_depth_loss(weights, termination_depth, steps, ends - starts, sigma)
+
+        predicted_depth = predicted_depth.expand(num_levels, *predicted_depth.shape).reshape(-1, 1)
+        return urban_radiance_field_depth_loss(weights, termination_depth, predicted_depth, steps, sigma)
+
+    # the remaining losses only depend on the rendered depth, so they are identical for every level
+    if depth_loss_type == DepthLossType.SIMPLE_LOSS:
+        return basic_depth_loss(termination_depth, predicted_depth)
+
+    if (
+        depth_loss_type == DepthLossType.DENSE_DEPTH_PRIORS_LOSS
+        and termination_uncertainty is not None
+        and predicted_uncertainty is not None
+    ):
+        return dense_depth_priors_loss(termination_depth, predicted_depth, termination_uncertainty, predicted_uncertainty)
+
+    if (
+        depth_loss_type == DepthLossType.DEPTH_UNCERTAINTY_WEIGHTED_LOSS
+        and termination_uncertainty is not None
+        and predicted_uncertainty is not None
+    ):
+        steps = (starts[-1] + ends[-1]) / 2
+        return depth_uncertainty_weighted_loss(
+            weights[-1],
+            termination_depth,
+            predicted_depth,
+            termination_uncertainty,
+            predicted_uncertainty,
+            steps,
+            uncertainty_weight=uncertainty_weight,
+        )
+
+    raise NotImplementedError("Provided depth loss type not implemented.")
+
+
+def depth_loss_over_levels(
+    weights_list: List[Float[Tensor, "*batch num_samples 1"]],
+    ray_samples_list: List[RaySamples],
+    termination_depth: Float[Tensor, "*batch 1"],
+    predicted_depth: Float[Tensor, "*batch 1"],
+    sigma: Float[Tensor, "1"],
+    directions_norm: Optional[Float[Tensor, "*batch 1"]],
+    is_euclidean: bool,
+    depth_loss_type: DepthLossType,
+    termination_uncertainty: Optional[Float[Tensor, "*batch 1"]] = None,
+    predicted_uncertainty: Optional[Float[Tensor, "*batch 1"]] = None,
+    uncertainty_weight: float = 1.0,
+    batched_loss_fn: Callable[..., Tensor] = depth_loss_batched,
+) -> Float[Tensor, ""]:
+    """Depth loss averaged over all sampling levels.
+
+    Levels with the same number of samples are stacked and evaluated with a single call of batched_loss_fn,
+    levels with a unique sample count are evaluated on their own without copying. Losses that do not depend on
+    the weights are identical for every level and are evaluated once.
+
+    Args:
+        weights_list: Weights predicted for each sample, for every sampling level.
+        ray_samples_list: Samples along rays corresponding to weights, for every sampling level.
+        termination_depth: Ground truth depth of rays.
+        predicted_depth: Depth prediction from the network.
+        sigma: Uncertainty around depth value.
+        directions_norm: Norms of ray direction vectors in the camera frame. Only used if is_euclidean is False.
+        is_euclidean: Whether ground truth depths corresponds to normalized direction vectors.
+        depth_loss_type: Type of depth loss to apply.
+        termination_uncertainty: Ground truth depth uncertainty of rays.
+        predicted_uncertainty: Depth uncertainty prediction from the network.
+        uncertainty_weight: Weight of the uncertainty term.
+        batched_loss_fn: Implementation of :func:`depth_loss_batched` to use, e.g. a compiled version of it.
+
+    Returns:
+        Depth loss scalar.
+    """
+    num_levels = len(weights_list)
+    if depth_loss_type in (DepthLossType.DS_NERF, DepthLossType.URF):
+        levels_by_num_samples: Dict[int, List[int]] = {}
+        for i, weights in enumerate(weights_list):
+            levels_by_num_samples.setdefault(weights.shape[-2], []).append(i)
+        level_groups = list(levels_by_num_samples.values())
+    else:
+        # the loss does not depend on the weights, every level would give the same value
+        level_groups = [[num_levels - 1]]
+        num_levels = 1
+
+    loss = 0.0
+    for levels in level_groups:
+        if len(levels) == 1:
+            weights = weights_list[levels[0]].unsqueeze(0)
+            starts = ray_samples_list[levels[0]].frustums.starts.unsqueeze(0)
+            ends = ray_samples_list[levels[0]].frustums.ends.unsqueeze(0)
+        else:
+            weights = torch.stack([weights_list[i] for i in levels], dim=0)
+            starts = torch.stack([ray_samples_list[i].frustums.starts for i in levels], dim=0)
+            ends = torch.stack([ray_samples_list[i].frustums.ends for i in levels], dim=0)
+        loss = loss + batched_loss_fn(
+            weights=weights,
+            starts=starts,
+            ends=ends,
+            termination_depth=termination_depth,
+            predicted_depth=predicted_depth,
+            sigma=sigma,
+            directions_norm=directions_norm,
+            is_euclidean=is_euclidean,
+            depth_loss_type=depth_loss_type,
+            termination_uncertainty=termination_uncertainty,
+            predicted_uncertainty=predicted_uncertainty,
+            uncertainty_weight=uncertainty_weight,
+        ) * (len(levels) / num_levels)
+    return loss
+
+
 def monosdf_normal_loss(
     normal_pred: Float[Tensor, "num_samples 3"], normal_gt: Float[Tensor, "num_samples 3"]
 ) -> Float[Tensor, "0"]:
@@ -245,6 +245,20 @@ class Model(nn.Module):
             A dictionary of metrics.
         """
 
+    def get_image_metrics(self, outputs: Dict[str, torch.Tensor], batch: Dict[str, torch.Tensor]) -> Dict[str, float]:
+        """Computes only the image metrics, for evaluations that discard the images.
+        Models can override this to skip building the images.
+
+        Args:
+            outputs: Outputs of the model.
+            batch: Batch of data.
+
+        Returns:
+            A dictionary of metrics.
+        """
+        metrics_dict, _ = self.get_image_metrics_and_images(outputs, batch)
+        return metrics_dict
+
     def load_model(self, loaded_state: Dict[str, Any]) -> None:
         """Load the checkpoint from the given path
 
@@ -23,13 +23,25 @@ from typing import Dict, Tuple, Type
 from matplotlib import pyplot as plt
 
 import torch
-import numpy as np
 
 from nerfstudio.cameras.rays import RayBundle
 from nerfstudio.model_components import losses
-from nerfstudio.model_components.losses import DepthLossType, depth_loss, depth_ranking_loss
+from nerfstudio.model_components.losses import (
+    DepthLossType,
+    depth_loss_batched,
+    depth_loss_over_levels,
+    depth_ranking_loss,
+)
 from nerfstudio.models.nerfacto import NerfactoModel, NerfactoModelConfig
 from nerfstudio.utils import colormaps
+from nerfstudio.utils.misc import torch_compile
+
+# Scene scale of the eval depths, metric units are obtained by dividing by it.
+DEPTH_SCALE = 0.25623789273
+# Converts an MSE computed in scene units to metric units.
+DEPTH_MSE_NORM = 1.0 / DEPTH_SCALE**2
+# Eval depths further than this (in metric units) are ignored.
+MAX_EVAL_DEPTH = 25.0
 
 
 @dataclass
@@ -68,14 +80,48 @@ class DepthNerfactoModel(NerfactoModel):
         """Set the fields and modules."""
         super().populate_modules()
 
+        # buffers follow the model across devices, so sigma never has to be copied to the GPU per step. It is kept
+        # out of the state dict so checkpoints keep the same keys as when sigma was a plain attribute.
         if self.config.should_decay_sigma:
-            self.depth_sigma = torch.tensor([self.config.starting_depth_sigma])
+            starting_depth_sigma = self.config.starting_depth_sigma
         else:
-            self.depth_sigma = torch.tensor([self.config.depth_sigma])
-            
+            starting_depth_sigma = self.config.depth_sigma
+        self.register_buffer("depth_sigma", torch.tensor([starting_depth_sigma]), persistent=False)
+
+        # classify the depth loss type once instead of on every training step
+        self._per_weight_losses = self.config.depth_loss_type in {
+            DepthLossType.DS_NERF,
+            DepthLossType.URF,
+            DepthLossType.SIMPLE_LOSS,
+            DepthLossType.DEPTH_UNCERTAINTY_WEIGHTED_LOSS,
+            DepthLossType.DENSE_DEPTH_PRIORS_LOSS,
+        }
+        self._needs_uncertainty = self.config.depth_loss_type in {
+            DepthLossType.DEPTH_UNCERTAINTY_WEIGHTED_LOSS,
+            DepthLossType.DENSE_DEPTH_PRIORS_LOSS,
+        }
+        self._is_ranking_loss = self.config.depth_loss_type == DepthLossType.SPARSENERF_RANKING
+        self._needs_directions_norm = not self.config.is_euclidean_depth and not self._is_ranking_loss
+
+        # the ranking loss weight ramps linearly from 0 to 0.2 over the first 2000 steps
+        self._ramp_slope = 0.2 / 2000.0
+
+        # fuse the point-wise depth loss ops. Compiling on CPU only slows down short runs such as unit tests, and the
+        # torch.jit.script fallback of PyTorch 1.x cannot script the loss, so only compile with torch.compile on CUDA.
+        if torch.cuda.is_available() and hasattr(torch, "compile"):
+            self._depth_loss_batched = torch_compile(dynamic=True, mode="reduce-overhead")(depth_loss_batched)
+        else:
+            self._depth_loss_batched = depth_loss_batched
+
     def get_outputs(self, ray_bundle: RayBundle):
         outputs = super().get_outputs(ray_bundle)
-        if ray_bundle.metadata is not None and "directions_norm" in ray_bundle.metadata:
+        # directions_norm is only needed to convert z-depths for the losses that use it, skip holding an extra
+        # reference to it otherwise
+        if (
+            self._needs_directions_norm
+            and ray_bundle.metadata is not None
+            and "directions_norm" in ray_bundle.metadata
+        ):
             outputs["directions_norm"] = ray_bundle.metadata["directions_norm"]
         return outputs
 
@@ -89,31 +135,35 @@ class DepthNerfactoModel(NerfactoModel):
                 raise ValueError(
                     f"Forcing pseudodepth loss, but depth loss type ({self.config.depth_loss_type}) must be one of {losses.PSEUDODEPTH_COMPATIBLE_LOSSES}"
                 )
-            if self.config.depth_loss_type in (DepthLossType.DS_NERF, DepthLossType.URF, DepthLossType.SIMPLE_LOSS, DepthLossType.DEPTH_UNCERTAINTY_WEIGHTED_LOSS, DepthLossType.DENSE_DEPTH_PRIORS_LOSS):
-                metrics_dict["depth_loss"] = 0.0
-                sigma = self._get_sigma().to(self.device)
+            if self._get_depth_loss_mult() == 0.0:
+                # the depth loss would be discarded, skip computing it but keep decaying sigma
+                self._get_sigma()
+                metrics_dict["depth_ranking" if self._is_ranking_loss else "depth_loss"] = torch.zeros(
+                    (), device=self.device
+                )
+            elif self._per_weight_losses:
+                sigma = self._get_sigma()
                 # get ground truth depth and uncertainty
                 termination_depth = batch["depth_image"].to(self.device)
                 
                 termination_uncertainty = None
-                if self.config.depth_loss_type in (DepthLossType.DEPTH_UNCERTAINTY_WEIGHTED_LOSS, DepthLossType.DENSE_DEPTH_PRIORS_LOSS):
+                if self._needs_uncertainty:
                     termination_uncertainty = batch["depth_uncertainty"].to(self.device)
-                # compute the depth loss for each weight
-                for i in range(len(outputs["weights_list"])):
-                    metrics_dict["depth_loss"] += depth_loss(
-                        weights=outputs["weights_list"][i],
-                        ray_samples=outputs["ray_samples_list"][i],
-                        termination_depth=termination_depth,
-                        predicted_depth=outputs["expected_depth"],
-                        sigma=sigma,
-                        directions_norm=outputs["directions_norm"],
-                        is_euclidean=self.config.is_euclidean_depth,
-                        depth_loss_type=self.config.depth_loss_type,
-                        termination_uncertainty=termination_uncertainty,
-                        predicted_uncertainty=outputs["depth_uncertainty"],
-                        uncertainty_weight=self.config.uncertainty_weight,
-                    ) / len(outputs["weights_list"])
-            elif self.config.depth_loss_type in (DepthLossType.SPARSENERF_RANKING,):
+                metrics_dict["depth_loss"] = depth_loss_over_levels(
+                    weights_list=outputs["weights_list"],
+                    ray_samples_list=outputs["ray_samples_list"],
+                    termination_depth=termination_depth,
+                    predicted_depth=outputs["expected_depth"],
+                    sigma=sigma,
+                    directions_norm=outputs.get("directions_norm"),
+                    is_euclidean=self.config.is_euclidean_depth,
+                    depth_loss_type=self.config.depth_loss_type,
+                    termination_uncertainty=termination_uncertainty,
+                    predicted_uncertainty=outputs["depth_uncertainty"],
+                    uncertainty_weight=self.config.uncertainty_weight,
+                    batched_loss_fn=self._depth_loss_batched,
+                )
+            elif self._is_ranking_loss:
                 metrics_dict["depth_ranking"] = depth_ranking_loss(
                     outputs["expected_depth"], batch["depth_image"].to(self.device)
                 )
@@ -128,74 +178,112 @@ class DepthNerfactoModel(NerfactoModel):
             assert metrics_dict is not None and ("depth_loss" in metrics_dict or "depth_ranking" in metrics_dict)
             if "depth_ranking" in metrics_dict:
                 loss_dict["depth_ranking"] = (
-                    self.config.depth_loss_mult
-                    * np.interp(self.step, [0, 2000], [0, 0.2])
+                    self._get_depth_loss_mult()
+                    * self._ramp_slope
+                    * min(max(self.step, 0), 2000)
                     * metrics_dict["depth_ranking"]
                 )
             if "depth_loss" in metrics_dict:
-                loss_dict["depth_loss"] = self.config.depth_loss_mult * metrics_dict["depth_loss"]
+                loss_dict["depth_loss"] = self._get_depth_loss_mult() * metrics_dict["depth_loss"]
         # if self.config.depth_loss_mult >= 0.005:
         #     self.config.depth_loss_mult = max(0.005, self.config.depth_loss_mult * 0.99)
         return loss_dict
 
+    @torch.no_grad()
     def get_image_metrics_and_images(
         self, outputs: Dict[str, torch.Tensor], batch: Dict[str, torch.Tensor]
     ) -> Tuple[Dict[str, float], Dict[str, torch.Tensor]]:
         """Appends ground truth depth to the depth image."""
-        scale = 0.25623789273
         metrics, images = super().get_image_metrics_and_images(outputs, batch)
-        
-        
-        supervised_depth = batch["depth_image"].to(self.device) / scale
-        
-        outputs["depth"] = outputs["depth"] / scale
-        
-        # ignore depths that are greater than 50
-        supervised_depth[outputs["depth"] > 25] = 0
-        
-        ground_truth_depth_colormap = colormaps.apply_depth_colormap(supervised_depth)
+        supervised_depth, predicted_depth, far_mask = self._get_eval_depths(outputs, batch)
+
+        # all depth ranges with a single host sync
+        gt_min, gt_max, predicted_min, predicted_max = torch.stack(
+            [*torch.aminmax(supervised_depth), *torch.aminmax(predicted_depth)]
+        ).tolist()
+        # the ground truth and prediction are colormapped separately on purpose: a single stacked call would need a
+        # full ones accumulation to leave the ground truth unmasked, and would force both to share one depth range
+        ground_truth_depth_colormap = colormaps.apply_depth_colormap(
+            supervised_depth, near_plane=gt_min, far_plane=gt_max
+        )
+        # the prediction uses the ground truth range, falling back to its own range where the ground truth's is 0
         predicted_depth_colormap = colormaps.apply_depth_colormap(
-            outputs["depth"],
+            predicted_depth,
             accumulation=outputs["accumulation"],
-            near_plane=float(torch.min(supervised_depth).cpu()),
-            far_plane=float(torch.max(supervised_depth).cpu()),
+            near_plane=gt_min or predicted_min,
+            far_plane=gt_max or predicted_max,
         )
         images["depth"] = torch.cat([ground_truth_depth_colormap, predicted_depth_colormap], dim=1)
-        
+
+        metrics.update(self._get_depth_metrics(supervised_depth, predicted_depth, far_mask, batch))
+        return metrics, images
+
+    @torch.no_grad()
+    def get_image_metrics(self, outputs: Dict[str, torch.Tensor], batch: Dict[str, torch.Tensor]) -> Dict[str, float]:
+        """Computes the image and depth metrics without building any colormaps."""
+        metrics = super().get_image_metrics(outputs, batch)
+        supervised_depth, predicted_depth, far_mask = self._get_eval_depths(outputs, batch)
+        metrics.update(self._get_depth_metrics(supervised_depth, predicted_depth, far_mask, batch))
+        return metrics
+
+    def _get_eval_depths(
+        self, outputs: Dict[str, torch.Tensor], batch: Dict[str, torch.Tensor]
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """Returns the supervised and predicted depths for evaluation, in scene units, and the mask of predictions
+        further than MAX_EVAL_DEPTH.
+
+        The depth colormaps are invariant to a uniform rescale and the MSE metrics are converted to metric units
+        after the reduction, so the depth images themselves are never rescaled.
+        """
+        supervised_depth = batch["depth_image"].to(self.device)
         if supervised_depth.shape[1] == 899:
             supervised_depth = supervised_depth[:548, :898, :]
-        
-        supervised_depth_mask = supervised_depth > 0
-        metrics["supervised_depth_mse"] = float(
-            torch.nn.functional.mse_loss(outputs["depth"][supervised_depth_mask], supervised_depth[supervised_depth_mask]).cpu()
-        )
-        
-        if "gt_object_depth_image" in batch and "gt_depth_image" in batch:
-        
-            gt_depth = batch["gt_depth_image"].to(self.device)
-            gt_depth[outputs["depth"] > 25] = 0
-            
-            gt_object_depth = batch["gt_object_depth_image"].to(self.device)
-            
-            print(gt_depth.shape, gt_object_depth.shape)
-            
-            depth_mask = gt_depth > 0
-            metrics["gt_depth_mse"] = float(
-                torch.nn.functional.mse_loss(outputs["depth"][depth_mask], gt_depth[depth_mask]).cpu()
-            )
-            
-            object_depth_mask = gt_object_depth > 0
-            metrics["gt_object_depth_mse"] = float(
-                torch.nn.functional.mse_loss(outputs["depth"][object_depth_mask], gt_object_depth[object_depth_mask]).cpu()
-            )
-            
-        return metrics, images
+
+        predicted_depth = outputs["depth"]
+
+        # ignore depths that are greater than MAX_EVAL_DEPTH, out of place to leave the batch untouched
+        far_mask = predicted_depth > MAX_EVAL_DEPTH * DEPTH_SCALE
+        supervised_depth = torch.where(far_mask, 0.0, supervised_depth)
+        return supervised_depth, predicted_depth, far_mask
+
+    def _get_depth_metrics(
+        self,
+        supervised_depth: torch.Tensor,
+        predicted_depth: torch.Tensor,
+        far_mask: torch.Tensor,
+        batch: Dict[str, torch.Tensor],
+    ) -> Dict[str, float]:
+        """Computes the depth MSE against the supervised and, if available, ground truth depths."""
+        gt_depths = {"supervised_depth_mse": supervised_depth}
+        # scales bringing each depth to scene units, the ground truth depths are in metric units
+        gt_scales = [1.0]
+
+        has_gt_depths = "gt_object_depth_image" in batch and "gt_depth_image" in batch
+        if has_gt_depths:
+            gt_depths["gt_depth_mse"] = batch["gt_depth_image"].to(self.device)
+            gt_depths["gt_object_depth_mse"] = batch["gt_object_depth_image"].to(self.device)
+            gt_scales += [DEPTH_SCALE, DEPTH_SCALE]
+
+        # masked MSE against every ground truth in one pass, only depths greater than 0 are valid
+        gts = torch.stack(list(gt_depths.values()))
+        masks = gts > 0
+        if has_gt_depths:
+            # ignore the scene depth where the prediction is too far
+            masks[1].masked_fill_(far_mask, False)
+        # the rescale of the ground truth depths is fused into the subtraction
+        gt_scales = gts.new_tensor(gt_scales).view(-1, *([1] * predicted_depth.dim()))
+        squared_errors = torch.addcmul(predicted_depth.unsqueeze(0), gts, gt_scales, value=-1.0).square_().mul_(masks)
+        mses = squared_errors.flatten(1).sum(-1) / masks.flatten(1).sum(-1)
+        return {key: mse * DEPTH_MSE_NORM for key, mse in zip(gt_depths.keys(), mses.tolist())}
 
     def _get_sigma(self):
         if not self.config.should_decay_sigma:
             return self.depth_sigma
 
-        self.depth_sigma = torch.maximum(
-            self.config.sigma_decay_rate * self.depth_sigma, torch.tensor([self.config.depth_sigma])
-        )
+        # decay in place, without allocating new tensors every step
+        self.depth_sigma.mul_(self.config.sigma_decay_rate).clamp_(min=self.config.depth_sigma)
         return self.depth_sigma
+
+    def _get_depth_loss_mult(self) -> float:
+        """Returns the depth loss multiplier for the current step. Override to schedule the depth loss."""
+        return self.config.depth_loss_mult
@@ -437,7 +437,7 @@ class VanillaPipeline(Pipeline):
                         
                         batch["is_real_world"] = True  
                         
-                        metrics_dict, _ = self.model.get_image_metrics_and_images(outputs, batch)
+                        metrics_dict = self.model.get_image_metrics(outputs, batch)
                         if output_path is not None:
                             raise NotImplementedError("Saving images is not implemented yet")
 
@@ -468,7 +468,7 @@ class VanillaPipeline(Pipeline):
                     outputs = self.model.get_outputs_for_camera(camera=camera)
                     height, width = camera.height, camera.width
                     num_rays = height * width
-                    metrics_dict, _ = self.model.get_image_metrics_and_images(outputs, batch)
+                    metrics_dict = self.model.get_image_metrics(outputs, batch)
                     if output_path is not None:
                         raise NotImplementedError("Saving images is not implemented yet")
 
@@ -4,7 +4,14 @@ Test losses
 
 import torch
 
-from nerfstudio.model_components.losses import tv_loss
+from nerfstudio.cameras.rays import Frustums, RaySamples
+from nerfstudio.model_components.losses import (
+    DepthLossType,
+    depth_loss,
+    depth_loss_batched,
+    depth_loss_over_levels,
+    tv_loss,
+)
 
 
 def test_tv_loss():
@@ -24,5 +31,100 @@ def test_tv_loss():
     assert tv_loss(grids).item() == 4.0
 
 
+NUM_RAYS = 16
+DEPTH_LOSS_TYPES = (
+    DepthLossType.DS_NERF,
+    DepthLossType.URF,
+    DepthLossType.SIMPLE_LOSS,
+    DepthLossType.DEPTH_UNCERTAINTY_WEIGHTED_LOSS,
+    DepthLossType.DENSE_DEPTH_PRIORS_LOSS,
+)
+
+
+def _make_depth_loss_inputs(num_samples_per_level):
+    """Random weights and ray samples for every level, plus the per-ray depth loss inputs"""
+    weights_list, ray_samples_list = [], []
+    for num_samples in num_samples_per_level:
+        starts = torch.sort(torch.rand([NUM_RAYS, num_samples, 1]) * 2, dim=-2).values
+        weights_list.append(torch.rand([NUM_RAYS, num_samples, 1]))
+        ray_samples_list.append(
+            RaySamples(
+                frustums=Frustums(
+                    origins=torch.zeros([NUM_RAYS, num_samples, 3]),
+                    directions=torch.ones([NUM_RAYS, num_samples, 3]),
+                    starts=starts,
+                    ends=starts + 0.1,
+                    pixel_area=torch.ones([NUM_RAYS, num_samples, 1]),
+                )
+            )
+        )
+    ray_inputs = {
+        "termination_depth": torch.rand([NUM_RAYS, 1]) * 2,
+        "predicted_depth": torch.rand([NUM_RAYS, 1]) * 2,
+        "sigma": torch.tensor([0.2]),
+        "termination_uncertainty": torch.rand([NUM_RAYS, 1]) * 0.5,
+        "predicted_uncertainty": torch.rand([NUM_RAYS, 1]) * 0.5 + 0.1,
+    }
+    return weights_list, ray_samples_list, ray_inputs
+
+
+def _reference_depth_loss(weights_list, ray_samples_list, ray_inputs, directions_norm, is_euclidean, depth_loss_type):
+    """Average of the per-level depth_loss, as the model computed it before batching"""
+    expected = 0.0
+    for weights, ray_samples in zip(weights_list, ray_samples_list):
+        expected += depth_loss(
+            weights=weights,
+            ray_samples=ray_samples,
+            directions_norm=torch.ones([NUM_RAYS, 1]) if directions_norm is None else directions_norm,
+            is_euclidean=is_euclidean,
+            depth_loss_type=depth_loss_type,
+            **ray_inputs,
+        ) / len(weights_list)
+    return expected
+
+
+def test_depth_loss_batched():
+    """Test that the batched depth loss matches the average of the per-level depth losses"""
+    weights_list, ray_samples_list, ray_inputs = _make_depth_loss_inputs((8, 8, 8))
+
+    for directions_norm, is_euclidean in ((torch.rand([NUM_RAYS, 1]) + 0.5, False), (None, True)):
+        for depth_loss_type in DEPTH_LOSS_TYPES:
+            expected = _reference_depth_loss(
+                weights_list, ray_samples_list, ray_inputs, directions_norm, is_euclidean, depth_loss_type
+            )
+            batched = depth_loss_batched(
+                weights=torch.stack(weights_list),
+                starts=torch.stack([ray_samples.frustums.starts for ray_samples in ray_samples_list]),
+                ends=torch.stack([ray_samples.frustums.ends for ray_samples in ray_samples_list]),
+                directions_norm=directions_norm,
+                is_euclidean=is_euclidean,
+                depth_loss_type=depth_loss_type,
+                **ray_inputs,
+            )
+            assert torch.allclose(batched, expected), depth_loss_type
+
+
+def test_depth_loss_over_levels():
+    """Test the depth loss over levels with different sample counts against the per-level average"""
+    weights_list, ray_samples_list, ray_inputs = _make_depth_loss_inputs((12, 8, 8))
+
+    for directions_norm, is_euclidean in ((torch.rand([NUM_RAYS, 1]) + 0.5, False), (None, True)):
+        for depth_loss_type in DEPTH_LOSS_TYPES:
+            expected = _reference_depth_loss(
+                weights_list, ray_samples_list, ray_inputs, directions_norm, is_euclidean, depth_loss_type
+            )
+            loss = depth_loss_over_levels(
+                weights_list=weights_list,
+                ray_samples_list=ray_samples_list,
+                directions_norm=directions_norm,
+                is_euclidean=is_euclidean,
+                depth_loss_type=depth_loss_type,
+                **ray_inputs,
+            )
+            assert torch.allclose(loss, expected), depth_loss_type
+
+
 if __name__ == "__main__":
     test_tv_loss()
+    test_depth_loss_batched()
+    test_depth_loss_over_levels()
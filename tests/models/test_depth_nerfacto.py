@@ -0,0 +1,61 @@
+"""
+Test depth nerfacto eval metrics
+"""
+from types import SimpleNamespace
+
+import pytest
+import torch
+
+from nerfstudio.models.depth_nerfacto import DEPTH_SCALE, DepthNerfactoModel
+
+HEIGHT, WIDTH = 12, 10
+
+
+def _baseline_depth_metrics(outputs, batch):
+    """Depth MSE metrics computed with per-mask gathers, as before the metrics were batched"""
+    predicted_depth = outputs["depth"] / DEPTH_SCALE
+    supervised_depth = batch["depth_image"] / DEPTH_SCALE
+    supervised_depth[predicted_depth > 25] = 0
+
+    def masked_mse(gt):
+        mask = gt > 0
+        return float(torch.nn.functional.mse_loss(predicted_depth[mask].double(), gt[mask].double()))
+
+    metrics = {"supervised_depth_mse": masked_mse(supervised_depth)}
+    if "gt_object_depth_image" in batch and "gt_depth_image" in batch:
+        gt_depth = batch["gt_depth_image"].clone()
+        gt_depth[predicted_depth > 25] = 0
+        metrics["gt_depth_mse"] = masked_mse(gt_depth)
+        metrics["gt_object_depth_mse"] = masked_mse(batch["gt_object_depth_image"])
+    return metrics
+
+
+def _random_depth(max_depth, invalid_fraction, dtype=torch.float32):
+    depth = torch.rand([HEIGHT, WIDTH, 1], dtype=dtype) * max_depth
+    depth[torch.rand([HEIGHT, WIDTH, 1]) < invalid_fraction] = 0
+    return depth
+
+
+@pytest.mark.parametrize("with_gt_depths", [False, True])
+def test_depth_metrics_match_baseline(with_gt_depths):
+    """Test the batched depth metrics against the per-mask formulation and that the batch is left untouched"""
+    # predictions range up to 40m so that some of them are beyond the 25m cutoff
+    outputs = {"depth": torch.rand([HEIGHT, WIDTH, 1]) * 40 * DEPTH_SCALE}
+    batch = {"depth_image": _random_depth(40 * DEPTH_SCALE, 0.3)}
+    if with_gt_depths:
+        # the pipeline loads the ground truth depths from numpy as float64
+        batch["gt_depth_image"] = _random_depth(40, 0.2, dtype=torch.float64)
+        batch["gt_object_depth_image"] = _random_depth(40, 0.6, dtype=torch.float64)
+    batch_before = {key: value.clone() for key, value in batch.items()}
+
+    model = SimpleNamespace(device=torch.device("cpu"))
+    supervised_depth, predicted_depth, far_mask = DepthNerfactoModel._get_eval_depths(model, outputs, batch)
+    metrics = DepthNerfactoModel._get_depth_metrics(model, supervised_depth, predicted_depth, far_mask, batch)
+
+    expected = _baseline_depth_metrics(outputs, {key: value.clone() for key, value in batch_before.items()})
+    assert metrics.keys() == expected.keys()
+    for key, value in expected.items():
+        assert value == pytest.approx(metrics[key], rel=1e-5), key
+
+    for key, value in batch_before.items():
+        assert torch.equal(batch[key], value), key